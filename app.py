@@ -1,10 +1,35 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
-from granite_helper import GigAI
 from datetime import datetime
-import html
+from functools import cache
+import hashlib
+import re
+import time
+
+# Upper bound on points sent to the browser for the trend chart
+MAX_TREND_POINTS = 2000
+# Minimum seconds between repaints while a chat answer streams in
+STREAM_FLUSH_INTERVAL = 0.05
+# Escapes for advice text embedded in HTML (quotes are safe inside element content)
+HTML_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+# Newlines become <br>; "- " list items become bullets
+ADVICE_NEWLINE = re.compile(r"\n(- )?")
+RECOMMENDATION_HTML = (
+    "<div class='recommendation-box'>"
+    "<h3 class='recommendation-header'>📊 Your Personalized Recommendations</h3>"
+    "<div class='recommendation-content'>{}</div>"
+    "</div>"
+)
+# Uploads larger than this are parsed with polars when it is installed
+POLARS_MIN_BYTES = 10_000_000
+# pandas' default missing-value markers, so the polars reader treats them the same way
+CSV_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+    "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "n/a", "nan", "null"
+]
+# Columns the app reads from uploaded CSVs (after name normalization)
+DATA_COLUMNS = {"date", "platform", "hours", "earnings", "miles"}
 
 # Page configuration
 st.set_page_config(
@@ -42,41 +67,179 @@ st.markdown("""
     font-size: 1.2rem;
     font-weight: 600;
 }
+.platform-table {
+    width: 100%;
+    border-collapse: collapse;
+}
+.platform-table th, .platform-table td {
+    padding: 0.5rem 0.75rem;
+    text-align: right;
+    border-bottom: 1px solid rgba(128,128,128,0.2);
+}
+.platform-table th:first-child, .platform-table td:first-child {
+    text-align: left;
+}
 </style>
 """, unsafe_allow_html=True)
 
 def display_recommendations(advice):
     """Display formatted recommendations"""
-    if advice.startswith("Error"):
-        st.error(advice)
-    else:
-        formatted_advice = html.escape(advice).replace("\n- ", "<br>• ").replace("\n", "<br>")
-        st.markdown(
-            "<div class='recommendation-box'>"
-            "<h3 class='recommendation-header'>📊 Your Personalized Recommendations</h3>"
-            f"<div class='recommendation-content'>{formatted_advice}</div>"
-            "</div>",
-            unsafe_allow_html=True
+    if "&" in advice or "<" in advice or ">" in advice:
+        advice = advice.translate(HTML_ESCAPES)
+    formatted_advice = ADVICE_NEWLINE.sub(lambda m: "<br>• " if m.group(1) else "<br>", advice)
+    st.markdown(RECOMMENDATION_HTML.format(formatted_advice), unsafe_allow_html=True)
+
+def lttb_downsample(y, n_out):
+    """Pick n_out indices of an evenly spaced series that preserve its shape (LTTB)"""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=np.float64)
+    # First and last points are always kept; the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    edges[-1] = n - 1
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
         )
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+def platform_summary(data):
+    """Per-platform earnings/hours totals and means via bincount over platform codes"""
+    codes, platforms = pd.factorize(data['platform'], sort=True)
+    valid = codes >= 0
+    codes = codes[valid]
+    n = len(platforms)
+    stats = {}
+    for col in ("earnings", "hours"):
+        values = data[col].to_numpy(dtype=np.float64, na_value=np.nan)[valid]
+        present = ~np.isnan(values)
+        # Missing values are skipped in both sum and mean, as groupby does
+        total = np.bincount(codes, weights=np.where(present, values, 0.0), minlength=n)
+        count = np.bincount(codes, weights=present, minlength=n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats[f"{col}_sum"], stats[f"{col}_mean"] = total, total / count
+    return pd.DataFrame(stats, index=pd.Index(platforms, name="platform"))
+
+def format_platform_summary(stats):
+    """Pre-format platform_summary output as display strings"""
+    return pd.DataFrame({
+        "Total Earnings": [f"${v:,.2f}" for v in stats["earnings_sum"]],
+        "Mean Earnings": [f"${v:.2f}" for v in stats["earnings_mean"]],
+        "Total Hours": [f"{v:,.1f} hrs" for v in stats["hours_sum"]],
+        "Mean Hours": [f"{v:.1f} hrs" for v in stats["hours_mean"]]
+    }, index=pd.Index(stats.index, name="Platform"))
+
+@st.cache_data
+def platform_table_html(fingerprint, _data):
+    # _data is excluded from Streamlit's cache key; fingerprint stands in for it
+    table = format_platform_summary(platform_summary(_data)).reset_index()
+    html = table.to_html(index=False, classes="platform-table", border=0)
+    # Keep st.markdown from reading "$...$" pairs as LaTeX
+    return html.replace("$", "&#36;")
+
+@cache
+def plotly_graph_objects():
+    # Imported on first chart render rather than at startup
+    import plotly.graph_objects
+    return plotly.graph_objects
 
 @st.cache_resource
 def init_gigai():
+    # Deferred so the IBM SDK is only loaded once AI features are used
+    from granite_helper import GigAI
     return GigAI()
 
+def data_fingerprint(data):
+    """Content hash of a dataframe, used to key cached LLM responses"""
+    row_hashes = pd.util.hash_pandas_object(data, index=False).to_numpy()
+    return hashlib.blake2b(row_hashes.tobytes(), digest_size=16).digest()
+
+def store_data(df):
+    """Keep loaded data in session state, with platform names stored as categorical codes"""
+    df = df.assign(platform=df['platform'].astype('category'))
+    st.session_state.data = df
+    st.session_state.fingerprint = data_fingerprint(df)
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def get_recommendations(fingerprint, day, _data):
+    # _data is excluded from Streamlit's cache key; fingerprint stands in for it.
+    # day is part of the key because the report prompt includes today's date.
+    advice = init_gigai().generate_judge_ready_recommendations(_data)
+    if advice.startswith("Error"):
+        # Raising keeps st.cache_data from storing the failed response
+        raise RuntimeError(advice)
+    return advice
+
+def render_stream(placeholder, chunks):
+    """Show streamed text in placeholder, repainting at most every STREAM_FLUSH_INTERVAL"""
+    buffer = []
+    last_flush = time.monotonic()
+    for chunk in chunks:
+        buffer.append(chunk)
+        now = time.monotonic()
+        if now - last_flush >= STREAM_FLUSH_INTERVAL:
+            # Plain text while streaming; markdown is rendered once at the end
+            placeholder.text("".join(buffer))
+            last_flush = now
+    response = "".join(buffer).strip()
+    placeholder.markdown(response)
+    return response
+
 @st.cache_data
 def load_sample_data():
+    # Seeded so the cached sample (and its download) is stable across sessions
+    rng = np.random.default_rng(0)
     dates = pd.date_range("2023-01-01", periods=90)
     return pd.DataFrame({
         "date": dates,
-        "earnings": np.random.randint(50, 200, size=90),
-        "hours": np.random.randint(2, 8, size=90),
-        "platform": np.random.choice(["Uber", "DoorDash", "Lyft"], size=90),
-        "miles": np.random.uniform(5, 50, size=90).round(1)
+        "earnings": rng.integers(50, 200, size=90, dtype=np.int32),
+        "hours": rng.integers(2, 8, size=90, dtype=np.int8),
+        "platform": np.array(["Uber", "DoorDash", "Lyft"])[rng.integers(0, 3, size=90)],
+        "miles": rng.uniform(5, 50, size=90).round(1)
     })
 
+@st.cache_data
+def sample_csv_bytes():
+    return load_sample_data().to_csv(index=False).encode()
+
+def normalize_column(name):
+    return name.strip().lower().replace(' ', '_')
+
+def read_gig_csv(uploaded_file):
+    """Read an uploaded CSV, parsing only the columns the app uses"""
+    if uploaded_file.size > POLARS_MIN_BYTES:
+        try:
+            import polars as pl
+        except ImportError:
+            pl = None
+        if pl is not None:
+            try:
+                header = pl.read_csv(uploaded_file, n_rows=0).columns
+                uploaded_file.seek(0)
+                columns = [col for col in header if normalize_column(col) in DATA_COLUMNS]
+                # Infer dtypes from every row, not just the first 100, as pandas does
+                return pl.read_csv(
+                    uploaded_file, columns=columns, infer_schema_length=None, null_values=CSV_NA_VALUES
+                ).to_pandas()
+            except pl.exceptions.PolarsError:
+                uploaded_file.seek(0)
+    return pd.read_csv(uploaded_file, usecols=lambda col: normalize_column(col) in DATA_COLUMNS)
+
 def validate_data(df):
     try:
-        df.columns = [col.strip().lower().replace(' ', '_') for col in df.columns]
+        df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_', regex=False)
         required = {"date", "platform", "hours", "earnings"}
         missing = required - set(df.columns)
         if missing:
@@ -84,19 +247,20 @@ def validate_data(df):
         df['date'] = pd.to_datetime(df['date'], errors='coerce')
         if df['date'].isnull().any():
             raise ValueError("Invalid date format in date column")
+        # Sorted dates let resampling take the monotonic fast path
+        df.sort_values('date', inplace=True, ignore_index=True)
         return df
     except Exception as e:
         st.error(f"Data validation error: {str(e)}")
         return None
 
 def main():
-    gig_ai = init_gigai()
-    
     st.title("🧠 Gig Worker Analytics Hub")
     st.markdown("Optimize your gig work performance with AI-powered insights")
     
     if "data" not in st.session_state:
         st.session_state.data = None
+        st.session_state.fingerprint = None
     if "messages" not in st.session_state:
         st.session_state.messages = []
     
@@ -111,13 +275,13 @@ def main():
                 with st.spinner("Processing data..."):
                     try:
                         if use_sample:
-                            st.session_state.data = load_sample_data()
+                            store_data(load_sample_data())
                             st.success("Sample data loaded!")
                         elif uploaded_file:
-                            df = pd.read_csv(uploaded_file)
+                            df = read_gig_csv(uploaded_file)
                             df = validate_data(df)
                             if df is not None:
-                                st.session_state.data = df
+                                store_data(df)
                                 st.success("Data loaded successfully!")
                         else:
                             st.warning("Please upload a file or use sample data")
@@ -125,10 +289,9 @@ def main():
                         st.error(f"Error loading data: {str(e)}")
 
         with st.expander("Download sample CSV"):
-            sample_df = load_sample_data()
             st.download_button(
                 label="Download sample data",
-                data=sample_df.to_csv(index=False),
+                data=sample_csv_bytes(),
                 file_name="gig_work_sample.csv",
                 mime="text/csv"
             )
@@ -136,49 +299,79 @@ def main():
     if st.session_state.data is not None:
         data = st.session_state.data
         st.subheader("📊 Performance Summary")
+        has_miles = 'miles' in data.columns
+        # One reduction per column; summing per column keeps integer totals as ints
+        sums = {col: data[col].sum() for col in ['earnings', 'hours'] + (['miles'] if has_miles else [])}
+        total_earnings, total_hours = sums['earnings'], sums['hours']
         col1, col2, col3, col4 = st.columns(4)
-        col1.metric("Total Earnings", f"${data['earnings'].sum():,}")
-        col2.metric("Total Hours", f"{data['hours'].sum():,} hrs")
-        hourly = data['earnings'].sum() / max(1, data['hours'].sum())
+        col1.metric("Total Earnings", f"${total_earnings:,}")
+        col2.metric("Total Hours", f"{total_hours:,} hrs")
+        hourly = total_earnings / (total_hours or 1)
         col3.metric("Avg Hourly Rate", f"${hourly:.2f}")
-        if 'miles' in data.columns:
-            mile_rate = data['earnings'].sum() / max(1, data['miles'].sum())
+        if has_miles:
+            mile_rate = total_earnings / (sums['miles'] or 1)
             col4.metric("Earnings/Mile", f"${mile_rate:.2f}")
         else:
             col4.metric("Total Jobs", len(data))
         
         tab1, tab2, tab3 = st.tabs(["📈 Trends", "🔍 Breakdown", "🗺️ Map View"])
         with tab1:
-            weekly = data.resample('W', on='date').sum(numeric_only=True)
-            fig = px.line(weekly, x=weekly.index, y="earnings", title="Weekly Earnings Trend")
+            weekly = data[['date', 'earnings']].resample('W', on='date')['earnings'].sum()
+            weekly = weekly.iloc[lttb_downsample(weekly.to_numpy(), MAX_TREND_POINTS)]
+            go = plotly_graph_objects()
+            # Scattergl renders through WebGL rather than one SVG path per trace
+            weeks = weekly.index
+            if weeks.tz is not None:
+                # Plot local wall-clock time; datetime64 conversion would shift to UTC
+                weeks = weeks.tz_localize(None)
+            fig = go.Figure(go.Scattergl(
+                x=weeks.to_numpy(dtype="datetime64[ms]"),
+                y=weekly.to_numpy(dtype=np.float64),
+                mode="lines",
+                name="earnings"
+            ))
+            # uirevision keeps the user's zoom/pan across reruns
+            fig.update_layout(
+                title="Weekly Earnings Trend",
+                xaxis_title="date",
+                yaxis_title="earnings",
+                uirevision="weekly"
+            )
             st.plotly_chart(fig, use_container_width=True)
         with tab2:
-            platform_stats = data.groupby("platform").agg({
-                "earnings": ["sum", "mean"],
-                "hours": ["sum", "mean"]
-            })
-            st.dataframe(platform_stats.style.format({
-                ('earnings', 'sum'): "${:,.2f}",
-                ('earnings', 'mean'): "${:.2f}",
-                ('hours', 'sum'): "{:,.1f} hrs",
-                ('hours', 'mean'): "{:.1f} hrs"
-            }), use_container_width=True)
+            st.markdown(
+                platform_table_html(st.session_state.fingerprint, data),
+                unsafe_allow_html=True
+            )
 
         st.subheader("🤖 AI Recommendations")
         if st.button("Get Personalized Advice", type="primary"):
             with st.spinner("Analyzing your gig patterns..."):
-                advice = gig_ai.predict_schedule(data)
-                display_recommendations(advice)
+                try:
+                    advice = get_recommendations(
+                        st.session_state.fingerprint, datetime.now().date().isoformat(), data
+                    )
+                except RuntimeError as e:
+                    st.error(str(e))
+                else:
+                    display_recommendations(advice)
         
         st.subheader("💬 Gig Work Advisor")
         for msg in st.session_state.messages:
             st.chat_message(msg["role"]).write(msg["content"])
         if prompt := st.chat_input("Ask about gig work strategies..."):
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.spinner("Generating response..."):
-                response = gig_ai.ask_question(prompt)
+            st.chat_message("user").write(prompt)
+            try:
+                gig_ai = init_gigai()
+            except RuntimeError as e:
+                # Nothing is recorded, so the unanswered prompt stays out of later history
+                st.error(str(e))
+            else:
+                history = st.session_state.messages[:]
+                with st.chat_message("assistant"):
+                    response = render_stream(st.empty(), gig_ai.stream_answer(prompt, history))
+                st.session_state.messages.append({"role": "user", "content": prompt})
                 st.session_state.messages.append({"role": "assistant", "content": response})
-                st.rerun()
 
 if __name__ == "__main__":
     main()
@@ -3,45 +3,34 @@ from dotenv import load_dotenv
 from ibm_watson_machine_learning.foundation_models import Model
 from ibm_watson_machine_learning.metanames import GenTextParamsMetaNames as Params
 from datetime import datetime
+from string import Template
 
 load_dotenv()
 
-class GigAI:
-    def __init__(self):
-        try:
-            self.credentials = {
-                "apikey": os.getenv("IBM_GRANITE_API_KEY"),
-                "url": os.getenv("IBM_GRANITE_URL", "https://us-south.ml.cloud.ibm.com")
-            }
-            self.project_id = os.getenv("IBM_GRANITE_PROJECT_ID")
-
-            if not all(self.credentials.values()) or not self.project_id:
-                raise ValueError("Missing IBM credentials in .env")
-
-            # Model configurations
-            self.model = Model(
-                model_id="ibm/granite-13b-instruct-v2",
-                credentials=self.credentials,
-                project_id=self.project_id,
-                params={
-                    Params.DECODING_METHOD: "greedy",
-                    Params.MAX_NEW_TOKENS: 1000,
-                    Params.TEMPERATURE: 0.3,
-                    Params.REPETITION_PENALTY: 1.2
-                }
-            )
-        except Exception as e:
-            raise RuntimeError(f"IBM Granite initialization failed: {str(e)}")
-
-    def generate_judge_ready_recommendations(self, data):
-        """Generate impressive, professionally formatted recommendations"""
-        try:
-            current_date = datetime.now().strftime("%B %d, %Y")
-            prompt = f"""As a gig economy expert, create a comprehensive performance report that would impress judges in a competition. 
-
-            Current Date: {current_date}
+# Character budget for chat history sent with a question (roughly 1500 tokens)
+HISTORY_CHAR_BUDGET = 6000
+# Prefix of the message returned/streamed when answering a question fails
+ANSWER_ERROR = "Error generating response"
+
+def trim_history(messages, max_chars=HISTORY_CHAR_BUDGET):
+    """Return the most recent messages whose combined content fits in max_chars"""
+    kept = []
+    total = 0
+    for msg in reversed(messages):
+        # Failed answers are not conversation context
+        if msg["role"] == "assistant" and ANSWER_ERROR in msg["content"]:
+            continue
+        total += len(msg["content"])
+        if total > max_chars:
+            break
+        kept.append(msg)
+    return kept[::-1]
+
+REPORT_PROMPT = Template("""As a gig economy expert, create a comprehensive performance report that would impress judges in a competition. 
+
+            Current Date: $date
             Data Sample:
-            {data.head().to_string()}
+            $head
 
             Format your response as a formal business report with these sections:
 
@@ -53,7 +42,7 @@ class GigAI:
             - Growth potential
 
             ## Performance Metrics
-            - Hourly earnings: ${data['earnings'].sum()/data['hours'].sum():.2f}
+            - Hourly earnings: $$$hourly
             - Efficiency metrics
             - Platform comparisons
 
@@ -76,18 +65,58 @@ class GigAI:
             - Growth opportunities
             - Sustainability considerations
 
-            Use professional business language with data-driven insights. Include specific numbers and percentages where possible."""
+            Use professional business language with data-driven insights. Include specific numbers and percentages where possible.""")
+
+class GigAI:
+    def __init__(self):
+        try:
+            self.credentials = {
+                "apikey": os.getenv("IBM_GRANITE_API_KEY"),
+                "url": os.getenv("IBM_GRANITE_URL", "https://us-south.ml.cloud.ibm.com")
+            }
+            self.project_id = os.getenv("IBM_GRANITE_PROJECT_ID")
+
+            if not all(self.credentials.values()) or not self.project_id:
+                raise ValueError("Missing IBM credentials in .env")
+
+            # Model configurations
+            self.model = Model(
+                model_id="ibm/granite-13b-instruct-v2",
+                credentials=self.credentials,
+                project_id=self.project_id,
+                params={
+                    Params.DECODING_METHOD: "greedy",
+                    Params.MAX_NEW_TOKENS: 1000,
+                    Params.TEMPERATURE: 0.3,
+                    Params.REPETITION_PENALTY: 1.2
+                }
+            )
+        except Exception as e:
+            raise RuntimeError(f"IBM Granite initialization failed: {str(e)}")
+
+    def generate_judge_ready_recommendations(self, data):
+        """Generate impressive, professionally formatted recommendations"""
+        try:
+            total_hours = data['hours'].sum()
+            prompt = REPORT_PROMPT.substitute(
+                date=datetime.now().strftime("%B %d, %Y"),
+                head=data.head().to_string(),
+                hourly=f"{data['earnings'].sum() / (total_hours or 1):.2f}"
+            )
             
             return self.model.generate_text(prompt).strip()
         except Exception as e:
             return f"Error generating report: {str(e)}"
 
-    def answer_question(self, question):
-        """Generate expert responses with academic rigor"""
-        try:
-            prompt = f"""As a gig economy professor preparing competition-level analysis, answer with academic rigor:
+    def _question_prompt(self, question, history=()):
+        history = trim_history(history)
+        context = ""
+        if history:
+            turns = "\n".join(f"{msg['role'].title()}: {msg['content']}" for msg in history)
+            context = f"Conversation so far:\n{turns}\n\n            "
+        return f"""As a gig economy professor preparing competition-level analysis, answer with academic rigor:
 
-            Question: {question}
+            {context}Question: {question}
 
             Structure your response with:
 
@@ -109,7 +138,18 @@ class GigAI:
             ### References
             - Academic sources
             - Industry reports"""
-            
-            return self.model.generate_text(prompt).strip()
+
+    # Non-streaming counterpart of stream_answer; the app's chat uses stream_answer
+    def answer_question(self, question, history=()):
+        """Generate expert responses with academic rigor"""
+        try:
+            return self.model.generate_text(self._question_prompt(question, history)).strip()
+        except Exception as e:
+            return f"{ANSWER_ERROR}: {str(e)}"
+
+    def stream_answer(self, question, history=()):
+        """Yield the answer to a question chunk by chunk as Granite generates it"""
+        try:
+            yield from self.model.generate_text_stream(self._question_prompt(question, history))
         except Exception as e:
-            return f"Error generating response: {str(e)}"
\ No newline at end of file
+            yield f"{ANSWER_ERROR}: {str(e)}"
\ No newline at end of file